@@ -1,43 +1,103 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ValidationError
 from typing import Dict, List, Optional
-import json
 from datetime import datetime
 import uuid
-import subprocess
+import hashlib
 import sys
+import asyncio
 import os
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import orjson
+from cachetools import TTLCache
 from typing import Any  # <-- Add this import
-from pydantic import BaseModel, ConfigDict
+
+from timetable_generator import ALL_SATISFIED, generate, required_sessions
+
+
+class ORJSONResponse(Response):
+    """JSON response rendered with orjson"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+# Worker processes for the CPU-bound scheduler
+WORKERS = os.cpu_count()
+
+# Timestamp reported by the root health check, refreshed once per second
+LAST_STAMP = datetime.now().isoformat()
+
+async def tick():
+    global LAST_STAMP
+    while True:
+        LAST_STAMP = datetime.now().isoformat()
+        await asyncio.sleep(1)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the OpenAPI schema once up front; FastAPI reuses app.openapi_schema afterwards
+    app.openapi_schema = app.openapi()
+    # Worker pool for the scheduler, with every worker started now so the
+    # first requests don't pay for it
+    executor = ProcessPoolExecutor(max_workers=WORKERS)
+    await asyncio.gather(*(asyncio.wrap_future(executor.submit(os.getpid)) for _ in range(WORKERS)))
+    # Shares progress queues and cancel events with the worker processes
+    manager = multiprocessing.Manager()
+    app.state.executor = executor
+    app.state.manager = manager
+    stamp_task = asyncio.create_task(tick())
+    try:
+        yield
+    finally:
+        stamp_task.cancel()
+        executor.shutdown(wait=True)
+        manager.shutdown()
 
 
 app = FastAPI(
     title="University Timetable Scheduler API",
     description="API for generating university timetables based on various constraints",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Configure CORS
+# Configure CORS (comma-separated origins in CORS_ORIGINS, defaults to the React dev server)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=os.environ.get("CORS_ORIGINS", "http://localhost:3000").split(","),
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
+# Compress large timetable responses
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Pydantic models for request/response validation
 class RoomInput(BaseModel):
     name: str
     capacity: int
     type: str
 
+class RoomDetails(BaseModel):
+    capacity: int
+    type: str
+
 class TimetableRequest(BaseModel):
     teachers: List[str]
     classes: List[str]
     subjects: List[str]
-    rooms: Dict[str, Dict[str, str]]  # {room_name: {capacity: int, type: str}}
+    rooms: Dict[str, RoomDetails]  # {room_name: {capacity: int, type: str}}
     time_slots: List[str]
     subject_credits: Dict[str, int]
     teacher_qualifications: Dict[str, List[str]]
@@ -47,6 +107,9 @@ class TimetableRequest(BaseModel):
     teacher_max_daily_load: int = 5
     consecutive_preferred: bool = True
     max_attempts: int = 200
+    forward_checking: bool = True
+    use_backjumping: bool = True
+    use_mrv: bool = True
 
 class TimetableEntry(BaseModel):
     subject: str
@@ -55,73 +118,107 @@ class TimetableEntry(BaseModel):
 
 class TimetableResponse(BaseModel):
     schedule: Dict[str, Dict[str, Optional[TimetableEntry]]]  # {class: {time_slot: entry}}
-    statistics: Dict[str, any]
+    statistics: Dict[str, Any]
     constraints: List[str]
+
+# Temporary storage for generated timetables (bounded, entries expire after an hour)
+TIMETABLE_CACHE = TTLCache(maxsize=1024, ttl=3600)
+
+# Solutions keyed by a hash of the request content, so identical requests skip the solver
+SOLUTION_CACHE = TTLCache(maxsize=1024, ttl=3600)
+
+def intern_schedule(output_data: Dict[str, Any]):
+    """
+    Intern the subject/teacher/room strings repeated across schedule entries
+    so cached timetables share one copy of each name
+    """
+    for slots in output_data["schedule"].values():
+        for entry in slots.values():
+            if entry:
+                for field in ("subject", "teacher", "room"):
+                    entry[field] = sys.intern(entry[field])
+
+def precheck_feasibility(request: TimetableRequest):
+    """
+    Reject trivially infeasible requests before running the solver
+    """
+    # Sessions each class needs (3+ credits also adds a lab session)
+    sessions = required_sessions(request.subject_credits)
     
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+    total_sessions = sum(sessions.values())
+    if total_sessions > len(request.time_slots):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Each class needs {total_sessions} sessions but only {len(request.time_slots)} time slots exist"
+        )
+    
+    qualified_subjects = set()
+    for subjects in request.teacher_qualifications.values():
+        qualified_subjects.update(subjects)
+    for subject in sessions:
+        if subject not in qualified_subjects:
+            raise HTTPException(
+                status_code=422,
+                detail=f"No qualified teachers available for {subject}"
+            )
+    
+    # Largest room per type; flex rooms can host any subject
+    largest_room = {}
+    for info in request.rooms.values():
+        largest_room[info.type] = max(largest_room.get(info.type, 0), info.capacity)
+    largest_class = max((request.class_sizes.get(cls, 0) for cls in request.classes), default=0)
+    for subject in sessions:
+        required_type = request.subject_room_requirements.get(subject, 'theory')
+        capacity = max(largest_room.get(required_type, 0), largest_room.get('flex', 0))
+        if capacity < largest_class:
+            raise HTTPException(
+                status_code=422,
+                detail=f"No {required_type} room can hold {largest_class} students for {subject}"
+            )
 
-# Temporary storage for generated timetables
-TIMETABLE_CACHE = {}
+async def solve(request: TimetableRequest) -> Dict[str, Any]:
+    """
+    Run the scheduler for one request, serving repeats of solved requests from the solution cache
+    """
+    # Prepare the input data for the scheduler
+    input_data = request.model_dump()
+    
+    # Serve repeated identical requests from the solution cache
+    key = hashlib.blake2b(
+        orjson.dumps(input_data, option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).hexdigest()
+    output_data = SOLUTION_CACHE.get(key)
+    
+    if output_data is None:
+        # Run the scheduler in a worker process so the event loop stays free
+        loop = asyncio.get_running_loop()
+        output_data = await loop.run_in_executor(app.state.executor, generate, input_data)
+        intern_schedule(output_data)
+        # The solver is randomized, so leave partial timetables uncached for retries
+        if output_data["constraints"] == [ALL_SATISFIED]:
+            SOLUTION_CACHE[key] = output_data
+    
+    return output_data
 
-@app.post("/generate-timetable", response_model=TimetableResponse)
+@app.post("/generate-timetable", response_model=None,
+          responses={200: {"model": TimetableResponse}})
 async def generate_timetable(request: TimetableRequest):
     """
     Generate a timetable based on the provided constraints and requirements
     """
+    precheck_feasibility(request)
+    
     try:
         # Generate a unique ID for this request
-        request_id = str(uuid.uuid4())
-        
-        # Prepare the input data for the Python script
-        input_data = {
-            "teachers": request.teachers,
-            "classes": request.classes,
-            "subjects": request.subjects,
-            "rooms": request.rooms,
-            "time_slots": request.time_slots,
-            "subject_credits": request.subject_credits,
-            "teacher_qualifications": request.teacher_qualifications,
-            "subject_room_requirements": request.subject_room_requirements,
-            "subject_prerequisites": request.subject_prerequisites,
-            "class_sizes": request.class_sizes,
-            "teacher_max_daily_load": request.teacher_max_daily_load,
-            "consecutive_preferred": request.consecutive_preferred,
-            "max_attempts": request.max_attempts
-        }
-        
-        # Save the input data to a temporary file
-        input_filename = f"timetable_input_{request_id}.json"
-        with open(input_filename, 'w') as f:
-            json.dump(input_data, f)
-        
-        # Execute the timetable generator script
-        script_path = os.path.join(os.path.dirname(__file__), 'timetable_generator.py')
-        result = subprocess.run(
-            [sys.executable, script_path, input_filename],
-            capture_output=True,
-            text=True
-        )
-        
-        # Check for errors
-        if result.returncode != 0:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Timetable generation failed: {result.stderr}"
-            )
-        
-        # Parse the output
-        output_filename = f"timetable_output_{request_id}.json"
-        with open(output_filename, 'r') as f:
-            output_data = json.load(f)
+        request_id = uuid.uuid4().hex
         
-        # Clean up temporary files
-        os.remove(input_filename)
-        os.remove(output_filename)
+        output_data = await solve(request)
         
         # Store in cache (for demo purposes)
         TIMETABLE_CACHE[request_id] = output_data
         
-        return output_data
+        # The scheduler output is trusted, so skip response model re-validation
+        return ORJSONResponse(output_data)
         
     except Exception as e:
         raise HTTPException(
@@ -129,7 +226,107 @@ async def generate_timetable(request: TimetableRequest):
             detail=f"Error generating timetable: {str(e)}"
         )
 
-@app.get("/timetable/{request_id}", response_model=TimetableResponse)
+@app.post("/generate-timetables-batch", response_model=None,
+          responses={200: {"model": List[TimetableResponse]}})
+async def generate_timetables_batch(requests: List[TimetableRequest]):
+    """
+    Generate several timetables concurrently on the shared worker pool
+    """
+    for request in requests:
+        precheck_feasibility(request)
+    
+    try:
+        # No ids are returned for batch results, so they aren't stored in TIMETABLE_CACHE
+        outputs = await asyncio.gather(*(solve(request) for request in requests))
+        
+        return ORJSONResponse(outputs)
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating timetables: {str(e)}"
+        )
+
+async def wait_for_disconnect(websocket: WebSocket):
+    """
+    Return once the client disconnects, ignoring any further messages
+    """
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@app.websocket("/ws/generate")
+async def generate_timetable_ws(websocket: WebSocket):
+    """
+    Generate a timetable, streaming partial timetables as the solver progresses.
+    
+    The client sends one TimetableRequest; the server replies with
+    {"type": "progress", ...} messages and a final {"type": "result", ...}.
+    Disconnecting cancels the solve.
+    """
+    await websocket.accept()
+    
+    try:
+        request = TimetableRequest.model_validate(await websocket.receive_json())
+        precheck_feasibility(request)
+    except WebSocketDisconnect:
+        return
+    except ValidationError as e:
+        await websocket.send_json({"type": "error", "detail": e.errors(include_url=False)})
+        await websocket.close()
+        return
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close()
+        return
+    except (KeyError, ValueError):
+        # receive_json raises KeyError on a binary frame and ValueError on bad JSON
+        await websocket.send_json({"type": "error", "detail": "Request must be a JSON text message"})
+        await websocket.close()
+        return
+    
+    manager = websocket.app.state.manager
+    progress_queue = manager.Queue()
+    cancel_event = manager.Event()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(websocket.app.state.executor, generate, request.model_dump(), progress_queue, cancel_event)
+    # Watch for the client leaving while the solver runs, not only on the next send
+    disconnect = asyncio.ensure_future(wait_for_disconnect(websocket))
+    
+    try:
+        # Forward partial timetables until the solver finishes; the blocking
+        # queue reads run on the default thread pool, off the event loop
+        while True:
+            finished = future.done()
+            get = loop.run_in_executor(None, progress_queue.get, True, 0.1)
+            await asyncio.wait({get, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                # Client went away: stop the solver between steps
+                get.cancel()
+                cancel_event.set()
+                return
+            try:
+                candidate = get.result()
+            except queue.Empty:
+                if finished:
+                    break
+                continue
+            await websocket.send_json({"type": "progress", **candidate})
+        
+        output_data = await future
+        await websocket.send_json({"type": "result", **output_data})
+        await websocket.close()
+        
+    except WebSocketDisconnect:
+        cancel_event.set()
+    except Exception as e:
+        cancel_event.set()
+        await websocket.send_json({"type": "error", "detail": f"Error generating timetable: {str(e)}"})
+        await websocket.close()
+    finally:
+        disconnect.cancel()
+
+@app.get("/timetable/{request_id}", response_model=None,
+         responses={200: {"model": TimetableResponse}})
 async def get_timetable(request_id: str):
     """
     Retrieve a previously generated timetable by its ID
@@ -139,12 +336,12 @@ async def get_timetable(request_id: str):
             status_code=404,
             detail="Timetable not found"
         )
-    return TIMETABLE_CACHE[request_id]
+    return ORJSONResponse(TIMETABLE_CACHE[request_id])
 
 @app.get("/")
 async def root():
     return {
         "message": "University Timetable Scheduler API",
         "status": "running",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": LAST_STAMP
     }
\ No newline at end of file
@@ -1,15 +1,39 @@
 import json
+import os
 import sys
+import tempfile
+from contextlib import redirect_stdout
 from collections import defaultdict, deque
 import heapq
 import random
-from copy import deepcopy
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Room type codes; any other room types get codes after these
+THEORY, LAB, FLEX = 0, 1, 2
+
+# Constraint report of a schedule that meets every requirement
+ALL_SATISFIED = "All constraints satisfied!"
+
+def required_sessions(subject_credits):
+    """Sessions each class needs per subject (3 credits = 3 theory + 1 lab)"""
+    sessions = {}
+    for subject, credits in subject_credits.items():
+        if credits > 0:
+            sessions[subject] = credits
+            if credits >= 3:
+                sessions[f"{subject} Lab"] = 1
+    return sessions
 
 class TimetableScheduler:
     def __init__(self, teachers, classes, subjects, rooms, time_slots, subject_credits, 
                  teacher_qualifications, subject_room_requirements, subject_prerequisites, 
                  class_sizes, teacher_max_daily_load=5, consecutive_preferred=True,
-                 max_attempts=100):
+                 max_attempts=100, forward_checking=True, use_backjumping=True,
+                 use_mrv=True, verbose=False):
         # Validate inputs
         self.validate_inputs(teachers, classes, subjects, rooms, time_slots, 
                            subject_credits, teacher_qualifications, class_sizes)
@@ -20,13 +44,25 @@ class TimetableScheduler:
         self.rooms = rooms
         self.time_slots = time_slots
         self.subject_credits = subject_credits
-        self.teacher_qualifications = teacher_qualifications
+        # Qualifications as sets for constant-time membership tests
+        self.teacher_qualifications = {
+            teacher: frozenset(subjects) for teacher, subjects in teacher_qualifications.items()
+        }
         self.subject_room_requirements = subject_room_requirements
         self.subject_prerequisites = subject_prerequisites
         self.class_sizes = class_sizes
         self.teacher_max_daily_load = teacher_max_daily_load
         self.consecutive_preferred = consecutive_preferred
         self.max_attempts = max_attempts
+        self.forward_checking = forward_checking
+        self.use_backjumping = use_backjumping
+        self.use_mrv = use_mrv
+        # Progress messages are buffered and only kept when verbose
+        self.verbose = verbose
+        self._log = []
+        
+        # Index qualified teachers by subject
+        self.setup_subject_teachers()
         
         # Check if we have enough teachers
         self.check_teacher_coverage()
@@ -37,6 +73,9 @@ class TimetableScheduler:
         # Check feasibility after setting up subject assignments
         self.validate_feasibility()
         
+        # Index time slots and days
+        self.setup_time_slots()
+        
         # Initialize tracking structures
         self.initialize_tracking_structures()
         
@@ -46,14 +85,17 @@ class TimetableScheduler:
         # Track room availability by type
         self.setup_room_types()
         
+        # Precompute suitable rooms for each class and required room type
+        self.setup_suitable_rooms()
+        
+        # Precompute candidate teachers and rooms for each class and subject
+        self.setup_domains()
+        
         # Track teacher availability
         self.setup_teacher_availability()
         
         # Lab room booking tracker
         self.lab_room_bookings = defaultdict(set)
-        
-        # Create time slot index for quick comparison
-        self.time_slot_index = {slot: idx for idx, slot in enumerate(self.time_slots)}
 
     def validate_inputs(self, teachers, classes, subjects, rooms, time_slots, 
                        subject_credits, teacher_qualifications, class_sizes):
@@ -75,6 +117,13 @@ class TimetableScheduler:
             if class_sizes[cls] <= 0:
                 raise ValueError(f"Invalid class size for {cls}")
 
+    def setup_subject_teachers(self):
+        """Map each subject to the teachers qualified to teach it"""
+        self._subject_to_teachers = defaultdict(list)
+        for teacher in self.teachers:
+            for subject in self.teacher_qualifications.get(teacher, frozenset()):
+                self._subject_to_teachers[subject].append(teacher)
+
     def check_teacher_coverage(self):
         """Check if we have enough qualified teachers for all subjects"""
         subject_coverage = defaultdict(int)
@@ -88,9 +137,7 @@ class TimetableScheduler:
         all_subjects = set(self.subjects) | lab_subjects
         
         for subject in all_subjects:
-            for teacher in self.teachers:
-                if subject in self.teacher_qualifications.get(teacher, []):
-                    subject_coverage[subject] += 1
+            subject_coverage[subject] = len(self._subject_to_teachers.get(subject, ()))
         
         # Check if any subject has no teachers
         for subject in all_subjects:
@@ -99,65 +146,130 @@ class TimetableScheduler:
 
     def setup_subject_assignments(self):
         """Convert credits to required sessions (3 credits = 3 theory + 1 lab)"""
-        self.subject_assignments = {}
-        for cls in self.classes:
-            self.subject_assignments[cls] = {}
-            for subject, credits in self.subject_credits.items():
-                if credits > 0:
-                    self.subject_assignments[cls][subject] = credits
-                    if credits >= 3:
-                        lab_subject = f"{subject} Lab"
-                        self.subject_assignments[cls][lab_subject] = 1
+        sessions = required_sessions(self.subject_credits)
+        self.subject_assignments = {cls: dict(sessions) for cls in self.classes}
+        
+        # Lab flag and theory subject of every assigned subject
+        all_subjects = {subject for assignments in self.subject_assignments.values()
+                        for subject in assignments}
+        self._is_lab = {subject: subject.endswith(" Lab") for subject in all_subjects}
+        self._base_subject = {subject: subject.replace(" Lab", "") for subject in all_subjects}
+        self.lab_theory = {subject: self._base_subject[subject] if self._is_lab[subject] else None
+                           for subject in all_subjects}
+        
+        self._total_required = sum(
+            required for assignments in self.subject_assignments.values()
+            for required in assignments.values()
+        )
+        
+        # Progress each session adds to its class priority
+        self._inv_required = {
+            cls: {subject: 1.0 / required for subject, required in assignments.items()}
+            for cls, assignments in self.subject_assignments.items()
+        }
 
     def validate_feasibility(self):
         """Check if scheduling is theoretically possible"""
-        total_required = 0
-        for cls in self.classes:
-            for subject, sessions in self.subject_assignments[cls].items():
-                total_required += sessions
-        
+        total_required = self._total_required
         total_teacher_capacity = len(self.teachers) * len(self.time_slots)
         
         if total_required > total_teacher_capacity:
             raise ValueError(f"Insufficient teacher capacity! Required: {total_required} sessions, Available: {total_teacher_capacity}")
 
+    def setup_time_slots(self):
+        """Index time slots and the days they fall on"""
+        # Create time slot index for quick comparison
+        self.time_slot_index = {slot: idx for idx, slot in enumerate(self.time_slots)}
+        
+        # Integer day IDs (e.g. "Mon" for "Mon-9AM") and the day of each time slot
+        self.days = list(dict.fromkeys(slot.split('-', 1)[0] for slot in self.time_slots))
+        self.day_id = {day: idx for idx, day in enumerate(self.days)}
+        self.time_slot_day = {slot: self.day_id[slot.split('-', 1)[0]] for slot in self.time_slots}
+        self.slot_day = [self.time_slot_day[slot] for slot in self.time_slots]
+        
+        # Bitmask of all time slots and of the time slots on each day (bit i = time slot i)
+        self.all_slots_mask = (1 << len(self.time_slots)) - 1
+        self.day_slot_mask = [0] * len(self.days)
+        for slot, idx in self.time_slot_index.items():
+            self.day_slot_mask[self.time_slot_day[slot]] |= 1 << idx
+
     def initialize_tracking_structures(self):
         """Initialize all tracking data structures"""
-        self.schedule = defaultdict(lambda: defaultdict(dict))
-        self.teacher_bookings = defaultdict(set)
-        self.class_bookings = defaultdict(set)
-        self.room_bookings = defaultdict(set)
-        self.teacher_daily_load = defaultdict(lambda: defaultdict(int))
+        self.schedule = {cls: {} for cls in self.classes}
+        # Booked time slots as bitmasks (bit i set = time slot i booked);
+        # room bookings are indexed by room ID. Teacher loads are popcounts
+        # of these, per day via day_slot_mask
+        self.teacher_bookings = defaultdict(int)
+        self.class_bookings = defaultdict(int)
+        self.room_bookings = [0] * len(self.rooms)
         self.class_subject_time = defaultdict(lambda: defaultdict(list))
+        # Same slots as class_subject_time, as bitmasks of slot indices
+        self._class_subject_slot_bits = defaultdict(lambda: defaultdict(int))
         self.teacher_schedule = defaultdict(dict)
         self.scheduled_counts = defaultdict(lambda: defaultdict(int))
+        self._total_scheduled = 0
         self.available_slots = set(self.time_slots)
         self.class_priority = {cls: 0 for cls in self.classes}
+        # Decision level of each (class, time_slot) assignment, used for backjumping
+        self.assignment_level = {}
+        self.decision_counter = 0
+        # Undo journal of schedule/unschedule operations, recorded while a backup is open
+        self._undo_stack = []
+        self._record = False
+        # State versions for memoizing has_available_slot: when each (class,
+        # subject) was last scheduled, and when each class, each teacher and any
+        # room last had a booking removed
+        self._state_version = 0
+        self._subject_version = defaultdict(int)
+        self._class_freed_version = defaultdict(int)
+        self._teacher_freed_version = defaultdict(int)
+        self._room_freed_version = 0
+        # (class, subject) -> (version, a valid (teacher, room_idx, slot_idx) or None)
+        self._domain_cache = {}
+        # (version, constraint report) of the last response
+        self._response_cache = None
 
     def setup_subject_order(self):
         """Precompute topological order of subjects for each class"""
+        # Orders memoized by subject set; prerequisites depend only on the
+        # subjects, so classes with the same subjects share one order
+        self._order_cache = {}
         self.subject_order = {}
         for cls in self.classes:
             self.subject_order[cls] = self.topological_sort_subjects(cls)
 
     def topological_sort_subjects(self, cls):
-        """Sort subjects based on prerequisites using Kahn's algorithm"""
+        """Sort a class's subjects based on prerequisites"""
         if cls not in self.subject_assignments:
             return []
-        
-        subjects = list(self.subject_assignments[cls].keys())
+        return self.topological_sort(list(self.subject_assignments[cls].keys()))
+
+    def topological_sort(self, subjects):
+        """Sort subjects based on prerequisites, reusing the order for a known subject set.
+        
+        Any order restricted to a subset of its subjects is still topological,
+        so the order for a set also serves the subjects left after some are done.
+        """
+        key = frozenset(subjects)
+        if key not in self._order_cache:
+            self._order_cache[key] = self._kahn_order(subjects)
+        return list(self._order_cache[key])
+
+    def _kahn_order(self, subjects):
+        """Sort subjects based on prerequisites using Kahn's algorithm"""
         graph = {subject: [] for subject in subjects}
         in_degree = {subject: 0 for subject in subjects}
         
         # Build prerequisite graph
         for subject in subjects:
-            base_subject = subject.replace(" Lab", "")
+            theory_subject = self.lab_theory.get(subject)
+            base_subject = theory_subject or subject
             for prereq in self.subject_prerequisites.get(base_subject, []):
                 if prereq in subjects:
                     graph[prereq].append(subject)
                     in_degree[subject] += 1
                 # Handle lab prerequisites
-                if subject.endswith(" Lab"):
+                if theory_subject is not None:
                     if base_subject in subjects:
                         graph[base_subject].append(subject)
                         in_degree[subject] += 1
@@ -181,6 +293,83 @@ class TimetableScheduler:
         self.room_types = defaultdict(list)
         for room, info in self.rooms.items():
             self.room_types[info['type']].append(room)
+        
+        # Integer room IDs with per-room attribute arrays for the slot search kernel
+        self.room_names = list(self.rooms)
+        self.room_id = {room: idx for idx, room in enumerate(self.room_names)}
+        self.room_capacity = [self.rooms[room]['capacity'] for room in self.room_names]
+        
+        # Room type codes and a [required type][room type] compatibility table:
+        # flex rooms can be used for any subject
+        type_names = ['theory', 'lab', 'flex']
+        for room_type in sorted({info['type'] for info in self.rooms.values()} |
+                                set(self.subject_room_requirements.values())):
+            if room_type not in type_names:
+                type_names.append(room_type)
+        self.room_type_code = {name: code for code, name in enumerate(type_names)}
+        self.room_type = [self.room_type_code[self.rooms[room]['type']] for room in self.room_names]
+        self._type_compat = [
+            [room_code == FLEX or room_code == required_code for room_code in range(len(type_names))]
+            for required_code in range(len(type_names))
+        ]
+        # Lab subjects that require a lab room can't use flex rooms either
+        self._lab_only_compat = [room_code == LAB for room_code in range(len(type_names))]
+
+    def compatible_room_types(self, subject):
+        """Row of the compatibility table for a subject, indexed by room type code"""
+        required_code = self.room_type_code[self.subject_room_requirements.get(subject, 'theory')]
+        if self._is_lab[subject] and required_code == LAB:
+            return self._lab_only_compat
+        return self._type_compat[required_code]
+
+    def setup_suitable_rooms(self):
+        """Precompute rooms each class can use per required type, smallest first"""
+        required_types = {'theory', 'lab'} | set(self.subject_room_requirements.values())
+        self._suitable_rooms = {}
+        self._suitable_room_ids = {}
+        for cls in self.classes:
+            for required_type in required_types:
+                compatible = self._type_compat[self.room_type_code[required_type]]
+                rooms = tuple(sorted(
+                    [room for room, info in self.rooms.items()
+                     if info['capacity'] >= self.class_sizes[cls] and
+                     compatible[self.room_type[self.room_id[room]]]],
+                    key=lambda r: self.rooms[r]['capacity']
+                ))
+                self._suitable_rooms[(cls, required_type)] = rooms
+                self._suitable_room_ids[(cls, required_type)] = [self.room_id[room] for room in rooms]
+
+    def setup_domains(self):
+        """Precompute the qualified teachers and usable rooms for each class and subject.
+        
+        These are the static part of each forward-checking domain; the time
+        slots left for a (teacher, room) pair follow from the booking bitmasks.
+        """
+        self._domain_candidates = {}
+        for cls, assignments in self.subject_assignments.items():
+            for subject in assignments:
+                compatible = self.compatible_room_types(subject)
+                room_ids = tuple(
+                    room_idx for room_idx in range(len(self.room_names))
+                    if self.class_sizes[cls] <= self.room_capacity[room_idx] and
+                    compatible[self.room_type[room_idx]]
+                )
+                teachers = tuple(self._subject_to_teachers.get(subject, ()))
+                self._domain_candidates[(cls, subject)] = (teachers, room_ids)
+        
+        # Constraint graph: subjects of the same class share slots, and subjects
+        # with a candidate teacher in common compete for that teacher
+        by_teacher = defaultdict(list)
+        for key, (teachers, _) in self._domain_candidates.items():
+            for teacher in teachers:
+                by_teacher[teacher].append(key)
+        self._subjects_by_teacher = {teacher: tuple(keys) for teacher, keys in by_teacher.items()}
+        self._degree = {}
+        for cls, subject in self._domain_candidates:
+            neighbors = {(cls, other) for other in self.subject_assignments[cls]}
+            for teacher in self._domain_candidates[(cls, subject)][0]:
+                neighbors.update(by_teacher[teacher])
+            self._degree[(cls, subject)] = len(neighbors) - 1
 
     def setup_teacher_availability(self):
         """Track teacher availability"""
@@ -189,52 +378,32 @@ class TimetableScheduler:
     def is_valid_assignment(self, cls, subject, teacher, room, time_slot):
         """Check if assignment meets all constraints"""
         # Basic availability constraints
-        if (time_slot in self.teacher_bookings[teacher] or
-            time_slot in self.class_bookings[cls] or
-            time_slot in self.room_bookings[room]):
+        slot_idx = self.time_slot_index[time_slot]
+        if (self.teacher_bookings[teacher] | self.class_bookings[cls] |
+                self.room_bookings[self.room_id[room]]) >> slot_idx & 1:
             return False
         
         # Teacher qualifications
-        if subject not in self.teacher_qualifications.get(teacher, []):
+        if subject not in self.teacher_qualifications.get(teacher, frozenset()):
             return False
         
         # Room capacity and type constraints
-        room_capacity = self.rooms[room]['capacity']
-        room_type = self.rooms[room]['type']
-        required_type = self.subject_room_requirements.get(subject, 'theory')
-        
-        if self.class_sizes[cls] > room_capacity:
+        room_idx = self.room_id[room]
+        if self.class_sizes[cls] > self.room_capacity[room_idx]:
             return False
-        
-        # Room type matching (flex rooms can be used for any subject)
-        if room_type != 'flex' and required_type != room_type:
+        if not self.compatible_room_types(subject)[self.room_type[room_idx]]:
             return False
         
-        # Lab room special handling
-        if subject.endswith(" Lab") and required_type == 'lab':
-            if room_type != 'lab':
-                return False
-        
         # Teacher daily load constraint
-        day = time_slot.split('-')[0]
-        if self.teacher_daily_load[teacher][day] >= self.teacher_max_daily_load:
+        day_mask = self.day_slot_mask[self.time_slot_day[time_slot]]
+        if (self.teacher_bookings[teacher] & day_mask).bit_count() >= self.teacher_max_daily_load:
             return False
         
         # Lab prerequisites - lab can only be scheduled after theory
-        if subject.endswith(" Lab"):
-            base_subject = subject.replace(" Lab", "")
-            if base_subject in self.class_subject_time[cls]:
-                theory_times = self.class_subject_time[cls][base_subject]
-                if not theory_times:
-                    return False
-                # Check if at least one theory session is before this lab
-                prereq_satisfied = any(
-                    self.time_slot_index[slot] < self.time_slot_index[time_slot]
-                    for slot in theory_times
-                )
-                if not prereq_satisfied:
-                    return False
-            else:
+        if self._is_lab[subject]:
+            # At least one theory session must be in an earlier slot
+            theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject], 0)
+            if not theory_bits & ((1 << slot_idx) - 1):
                 return False
         
         return True
@@ -243,7 +412,12 @@ class TimetableScheduler:
         """Make an assignment and update tracking structures"""
         if not self.is_valid_assignment(cls, subject, teacher, room, time_slot):
             return False
-            
+        
+        self._schedule_subject_unchecked(cls, subject, teacher, room, time_slot)
+        return True
+
+    def _schedule_subject_unchecked(self, cls, subject, teacher, room, time_slot):
+        """Make an assignment without checking constraints"""
         self.schedule[cls][time_slot] = {
             'subject': subject,
             'teacher': teacher,
@@ -251,32 +425,35 @@ class TimetableScheduler:
         }
         
         # Update tracking structures
-        self.teacher_bookings[teacher].add(time_slot)
-        self.class_bookings[cls].add(time_slot)
-        self.room_bookings[room].add(time_slot)
+        slot_bit = 1 << self.time_slot_index[time_slot]
+        self.teacher_bookings[teacher] |= slot_bit
+        self.class_bookings[cls] |= slot_bit
+        self.room_bookings[self.room_id[room]] |= slot_bit
         self.scheduled_counts[cls][subject] += 1
-        
-        # Update daily load
-        day = time_slot.split('-')[0]
-        self.teacher_daily_load[teacher][day] += 1
+        self._total_scheduled += 1
         
         # Record subject time
         self.class_subject_time[cls][subject].append(time_slot)
+        self._class_subject_slot_bits[cls][subject] |= slot_bit
         self.teacher_schedule[teacher][time_slot] = (cls, subject)
         
+        # Record decision level
+        self.decision_counter += 1
+        self.assignment_level[(cls, time_slot)] = self.decision_counter
+        
         # Update class priority
-        self.class_priority[cls] = sum(
-            self.scheduled_counts[cls].get(subj, 0) / req 
-            for subj, req in self.subject_assignments[cls].items()
-        )
+        self.class_priority[cls] += self._inv_required[cls].get(subject, 0.0)
         
         # Track lab room usage
-        if subject.endswith(" Lab") and self.rooms[room]['type'] == 'lab':
+        if self._is_lab[subject] and self.rooms[room]['type'] == 'lab':
             if time_slot not in self.lab_room_bookings:
                 self.lab_room_bookings[time_slot] = set()
             self.lab_room_bookings[time_slot].add(room)
-            
-        return True
+        
+        self._bump_versions(cls, subject)
+        
+        if self._record:
+            self._undo_stack.append(('schedule', cls, time_slot))
 
     def unschedule_subject(self, cls, time_slot):
         """Remove an assignment and update tracking structures"""
@@ -288,33 +465,38 @@ class TimetableScheduler:
         teacher = entry['teacher']
         room = entry['room']
         
+        if self._record:
+            self._undo_stack.append(
+                ('unschedule', cls, time_slot, entry, self.assignment_level.get((cls, time_slot)))
+            )
+        
         # Remove from tracking structures
-        self.teacher_bookings[teacher].discard(time_slot)
-        self.class_bookings[cls].discard(time_slot)
-        self.room_bookings[room].discard(time_slot)
+        slot_bit = 1 << self.time_slot_index[time_slot]
+        self.teacher_bookings[teacher] &= ~slot_bit
+        self.class_bookings[cls] &= ~slot_bit
+        self.room_bookings[self.room_id[room]] &= ~slot_bit
         self.scheduled_counts[cls][subject] -= 1
-        
-        # Update daily load
-        day = time_slot.split('-')[0]
-        self.teacher_daily_load[teacher][day] -= 1
+        self._total_scheduled -= 1
         
         # Remove from subject time tracking
         if subject in self.class_subject_time[cls]:
             if time_slot in self.class_subject_time[cls][subject]:
                 self.class_subject_time[cls][subject].remove(time_slot)
+                self._class_subject_slot_bits[cls][subject] &= ~slot_bit
         
         # Remove from teacher schedule
         if teacher in self.teacher_schedule and time_slot in self.teacher_schedule[teacher]:
             del self.teacher_schedule[teacher][time_slot]
         
+        self.assignment_level.pop((cls, time_slot), None)
+        
         # Update class priority
-        self.class_priority[cls] = sum(
-            self.scheduled_counts[cls].get(subj, 0) / req 
-            for subj, req in self.subject_assignments[cls].items()
-        )
+        self.class_priority[cls] -= self._inv_required[cls].get(subject, 0.0)
+        
+        self._bump_versions(cls, subject, freed_teacher=teacher)
         
         # Remove lab room booking
-        if subject.endswith(" Lab") and self.rooms[room]['type'] == 'lab' and time_slot in self.lab_room_bookings:
+        if self._is_lab[subject] and self.rooms[room]['type'] == 'lab' and time_slot in self.lab_room_bookings:
             if room in self.lab_room_bookings[time_slot]:
                 self.lab_room_bookings[time_slot].remove(room)
                 if not self.lab_room_bookings[time_slot]:
@@ -324,112 +506,188 @@ class TimetableScheduler:
         del self.schedule[cls][time_slot]
         return True
     
-    def calculate_slot_score(self, cls, subject, teacher, room, time_slot, prefer_consecutive):
-        """Calculate score for a given time slot"""
-        score = 0
-        
-        # Prefer consecutive sessions for the same subject
-        if prefer_consecutive and subject in self.class_subject_time[cls]:
-            existing_times = self.class_subject_time[cls][subject]
-            if existing_times:
-                current_idx = self.time_slot_index[time_slot]
-                min_distance = min(abs(current_idx - self.time_slot_index[t]) for t in existing_times)
-                if min_distance == 1:
-                    score += 10
-                elif min_distance <= 3:
-                    score += 5
-        
-        # Prefer less loaded teachers
-        teacher_load = sum(self.teacher_daily_load[teacher].values())
-        score += (10 - teacher_load) * 0.5
-        day = time_slot.split('-')[0]
-        daily_load = self.teacher_daily_load[teacher][day]
-        score += (self.teacher_max_daily_load - daily_load) * 0.2
-        
-        # Prioritize scheduling subjects with unmet requirements
-        if self.scheduled_counts[cls][subject] < self.subject_assignments[cls][subject]:
-            score += 20  # Boost score for unmet requirements
-            
-        # Prioritize lab room for lab subjects
-        if subject.endswith(" Lab") and self.rooms[room]['type'] == 'lab':
-            score += 50
-            
-        # Prioritize classes that are behind schedule
-        class_progress = self.class_priority[cls]
-        score += (1 - class_progress) * 30
-            
-        return score
+    def _bump_versions(self, cls, subject, freed_teacher=None):
+        """Record a booking change; freed_teacher is given when a booking was removed"""
+        self._state_version += 1
+        version = self._state_version
+        self._subject_version[(cls, subject)] = version
+        if freed_teacher is not None:
+            self._class_freed_version[cls] = version
+            self._teacher_freed_version[freed_teacher] = version
+            self._room_freed_version = version
+    
+    def teacher_total_load(self, teacher):
+        """Number of sessions booked for a teacher"""
+        return self.teacher_bookings[teacher].bit_count()
+
+    def teacher_daily_loads(self, teacher):
+        """Sessions booked for a teacher on each day, indexed by day ID"""
+        bookings = self.teacher_bookings[teacher]
+        return [(bookings & day_mask).bit_count() for day_mask in self.day_slot_mask]
 
     def get_qualified_teachers(self, subject):
         """Get qualified teachers sorted by current load and availability"""
-        qualified = [t for t in self.teachers 
-                    if subject in self.teacher_qualifications.get(t, [])]
+        qualified = self._subject_to_teachers.get(subject, ())
         
         # Sort by current load (least busy first), then by number of remaining available slots
         return sorted(qualified,
                      key=lambda t: (
-                         sum(self.teacher_daily_load[t].values()),
+                         self.teacher_total_load(t),
                          -len(self.teacher_availability[t])
                      ))
 
+    def _slot_search_rooms(self, cls, subject):
+        """Rooms a class can use for a subject, smallest first"""
+        is_lab = self._is_lab[subject]
+        required_type = 'lab' if is_lab else self.subject_room_requirements.get(subject, 'theory')
+        suitable_rooms = self._suitable_room_ids[(cls, required_type)]
+        if not suitable_rooms:
+            self.log("        No suitable rooms found for %s (need %s, class size %s)", subject, required_type, self.class_sizes[cls])
+        return suitable_rooms
+
     def find_available_slot(self, cls, subject, teacher, prefer_consecutive=True):
         """Find available slot with soft constraint optimization"""
-        best_slot = None
-        best_score = -1
-        
-        is_lab = subject.endswith(" Lab")
-        required_type = 'lab' if is_lab else self.subject_room_requirements.get(subject, 'theory')
-        
-        # Get appropriate rooms - prioritize smaller rooms first
-        suitable_rooms = sorted(
-            [room for room, info in self.rooms.items() 
-             if info['capacity'] >= self.class_sizes[cls] and 
-             (info['type'] == 'flex' or info['type'] == required_type)],
-            key=lambda r: self.rooms[r]['capacity']
-        )
-        
+        suitable_rooms = self._slot_search_rooms(cls, subject)
         if not suitable_rooms:
-            print(f"        No suitable rooms found for {subject} (need {required_type}, class size {self.class_sizes[cls]})")
             return None
         
-        # Try each time slot in random order to distribute load
-        for time_slot in random.sample(self.time_slots, len(self.time_slots)):
-            for room in suitable_rooms:
-                # Skip lab room if already booked for this time slot
-                if self.rooms[room]['type'] == 'lab' and time_slot in self.lab_room_bookings:
-                    if len(self.lab_room_bookings[time_slot]) >= 1:  # Only one lab can use a lab room at a time
-                        continue
-                    
-                if self.is_valid_assignment(cls, subject, teacher, room, time_slot):
-                    score = self.calculate_slot_score(cls, subject, teacher, room, time_slot, prefer_consecutive)
-                    
-                    if score > best_score:
-                        best_slot = (time_slot, room)
-                        best_score = score
+        best = self._find_slot_kernel(cls, subject, teacher, suitable_rooms, prefer_consecutive)
         
-        if not best_slot:
-            print(f"        No valid time slots found for {subject} with {teacher}")
+        if best is None:
+            self.log("        No valid time slots found for %s with %s", subject, teacher)
             return None
-        return best_slot
+        slot_idx, room_idx = best
+        return self.time_slots[slot_idx], self.room_names[room_idx]
+
+    def ranked_slots(self, cls, subject, teacher, prefer_consecutive=True):
+        """List every valid (time_slot, room) for a teacher, best first"""
+        suitable_rooms = self._slot_search_rooms(cls, subject)
+        if not suitable_rooms:
+            return []
+        ranked = self._find_slot_kernel(cls, subject, teacher, suitable_rooms, prefer_consecutive, ranked=True)
+        return [(self.time_slots[slot_idx], self.room_names[room_idx]) for slot_idx, room_idx in ranked]
+
+    def _find_slot_kernel(self, cls, subject, teacher, room_ids, prefer_consecutive, ranked=False):
+        """Search all (slot, room) candidates on integer-encoded state.
+        
+        Applies the same constraints as is_valid_assignment using bitmasks and
+        room attribute arrays, and returns the best (slot_idx, room_idx) or None.
+        With ranked, returns every candidate instead, best first (ties keep the
+        search order, so the first one is the one returned otherwise).
+        """
+        if subject not in self.teacher_qualifications.get(teacher, frozenset()):
+            return [] if ranked else None
+        
+        # Rooms passing the capacity and type constraints
+        class_size = self.class_sizes[cls]
+        is_lab = self._is_lab[subject]
+        compatible = self.compatible_room_types(subject)
+        candidate_rooms = [
+            room_idx for room_idx in room_ids
+            if class_size <= self.room_capacity[room_idx] and compatible[self.room_type[room_idx]]
+        ]
+        
+        # Slots ruled out for every room: teacher or class busy, or teacher's day full
+        teacher_bookings = self.teacher_bookings[teacher]
+        daily_loads = self.teacher_daily_loads(teacher)
+        blocked = teacher_bookings | self.class_bookings[cls]
+        for day, load in enumerate(daily_loads):
+            if load >= self.teacher_max_daily_load:
+                blocked |= self.day_slot_mask[day]
+        
+        # Labs must come after at least one theory session
+        if is_lab:
+            theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject])
+            if not theory_bits:
+                return [] if ranked else None
+            # Block every slot up to and including the earliest theory session
+            earliest_bit = theory_bits & -theory_bits
+            blocked |= (earliest_bit << 1) - 1
+        
+        # Slot score terms, hoisted out of the candidate loop: per call (less
+        # loaded teacher, unmet requirement, class behind schedule), per day
+        # (teacher daily load) and per slot (consecutive-session bonus)
+        base_score = (10 - teacher_bookings.bit_count()) * 0.5
+        if self.scheduled_counts[cls][subject] < self.subject_assignments[cls][subject]:
+            base_score += 20
+        base_score += (1 - self.class_priority[cls]) * 30
+        day_score = [(self.teacher_max_daily_load - load) * 0.2 for load in daily_loads]
+        
+        bits = self._class_subject_slot_bits[cls].get(subject) if prefer_consecutive else 0
+        if bits:
+            near1 = (bits << 1) | (bits >> 1)
+            near3 = bits | near1 | (bits << 2) | (bits >> 2) | (bits << 3) | (bits >> 3)
+        
+        # Lab subjects prefer lab rooms
+        rooms = [(room_idx, self.room_type[room_idx] == LAB) for room_idx in candidate_rooms]
+        room_bonus = 50 if is_lab else 0
+        
+        room_bookings = self.room_bookings
+        time_slots = self.time_slots
+        slot_day = self.slot_day
+        rand = random.random
+        
+        # Scores can be negative for classes far along, so any valid slot beats none
+        best = None
+        best_score = float('-inf')
+        candidates = []
+        
+        # Walk the unblocked slots in order, lowest bit first
+        free = self.all_slots_mask & ~blocked
+        while free:
+            slot_bit = free & -free
+            free ^= slot_bit
+            slot_idx = slot_bit.bit_length() - 1
+            time_slot = time_slots[slot_idx]
+            # Only one lab can use a lab room at a time
+            lab_rooms_taken = bool(self.lab_room_bookings.get(time_slot))
+            
+            slot_score = base_score + day_score[slot_day[slot_idx]]
+            if bits:
+                if bits & slot_bit:
+                    slot_score += 5
+                elif near1 & slot_bit:
+                    slot_score += 10
+                elif near3 & slot_bit:
+                    slot_score += 5
+            # Random jitter breaks ties between slots to distribute load; rooms
+            # within a slot keep their order, so the smallest fitting room wins
+            slot_score += rand() * 1e-6
+            
+            for room_idx, lab_room in rooms:
+                if room_bookings[room_idx] & slot_bit:
+                    continue
+                if lab_rooms_taken and lab_room:
+                    continue
+                
+                score = slot_score + room_bonus if lab_room else slot_score
+                if ranked:
+                    candidates.append((score, (slot_idx, room_idx)))
+                elif score > best_score:
+                    best = (slot_idx, room_idx)
+                    best_score = score
+        
+        if ranked:
+            # Stable sort: equal scores stay in search order
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            return [candidate for _, candidate in candidates]
+        return best
 
     def schedule_any_teacher(self, cls, subject, remaining):
         """Attempt to schedule with any qualified teacher when normal scheduling fails"""
-        for teacher in self.teachers:
-            if subject in self.teacher_qualifications.get(teacher, []):
-                for time_slot in self.time_slots:
-                    for room, info in self.rooms.items():
-                        if (info['capacity'] >= self.class_sizes[cls] and 
-                            (info['type'] == 'flex' or 
-                             info['type'] == self.subject_room_requirements.get(subject, 'theory'))):
-                            # Skip lab room if already booked
-                            if info['type'] == 'lab' and time_slot in self.lab_room_bookings:
-                                if len(self.lab_room_bookings[time_slot]) >= 1:
-                                    continue
-                                
-                            if self.schedule_subject(cls, subject, teacher, room, time_slot):
-                                remaining -= 1
-                                if remaining == 0:
-                                    return True
+        suitable_rooms = self._suitable_rooms[(cls, self.subject_room_requirements.get(subject, 'theory'))]
+        for teacher in self._subject_to_teachers.get(subject, ()):
+            for time_slot in self.time_slots:
+                for room in suitable_rooms:
+                    # Skip lab room if already booked
+                    if self.room_type[self.room_id[room]] == LAB and time_slot in self.lab_room_bookings:
+                        if len(self.lab_room_bookings[time_slot]) >= 1:
+                            continue
+                        
+                    if self.schedule_subject(cls, subject, teacher, room, time_slot):
+                        remaining -= 1
+                        if remaining == 0:
+                            return True
         return False
 
     def schedule_subject_sessions(self, cls, subject, required_sessions):
@@ -438,10 +696,10 @@ class TimetableScheduler:
         qualified_teachers = self.get_qualified_teachers(subject)
         
         if not qualified_teachers:
-            print(f"ERROR: No qualified teachers for {subject}")
+            self.log("ERROR: No qualified teachers for %s", subject)
             return 0
         
-        print(f"Scheduling {required_sessions} sessions of {subject} for {cls}")
+        self.log("Scheduling %s sessions of %s for %s", required_sessions, subject, cls)
         
         attempts = 0
         while scheduled < required_sessions and attempts < self.max_attempts:
@@ -452,19 +710,18 @@ class TimetableScheduler:
                 slot_info = self.find_available_slot(cls, subject, teacher)
                 if slot_info:
                     time_slot, room = slot_info
-                    print(f"  Attempting to schedule {subject} with {teacher} in {room} at {time_slot}")
-                    if self.schedule_subject(cls, subject, teacher, room, time_slot):
-                        scheduled += 1
-                        success = True
-                        print(f"  ✓ Successfully scheduled session {scheduled}")
-                        break
-                    else:
-                        print(f"  ✗ Failed to schedule (constraint violation)")
+                    self.log("  Attempting to schedule %s with %s in %s at %s", subject, teacher, room, time_slot)
+                    # find_available_slot only returns valid assignments
+                    self._schedule_subject_unchecked(cls, subject, teacher, room, time_slot)
+                    scheduled += 1
+                    success = True
+                    self.log("  ✓ Successfully scheduled session %s", scheduled)
+                    break
                 else:
-                    print(f"  ✗ No available slot found for {teacher}")
+                    self.log("  ✗ No available slot found for %s", teacher)
             
             if not success:
-                print(f"  ⚠️ Could not schedule session {scheduled + 1} of {subject} for {cls}")
+                self.log("  ⚠️ Could not schedule session %s of %s for %s", scheduled + 1, subject, cls)
                 if self.resolve_conflicts_aggressive(cls, subject):
                     scheduled += 1
                 else:
@@ -473,7 +730,7 @@ class TimetableScheduler:
         # If still not scheduled, try with any teacher
         if scheduled < required_sessions:
             remaining = required_sessions - scheduled
-            print(f"  Trying emergency scheduling for {remaining} sessions of {subject}")
+            self.log("  Trying emergency scheduling for %s sessions of %s", remaining, subject)
             if self.schedule_any_teacher(cls, subject, remaining):
                 scheduled += remaining
         
@@ -481,17 +738,15 @@ class TimetableScheduler:
 
     def resolve_conflicts_aggressive(self, cls, subject):
         """More aggressive conflict resolution by trying to move multiple subjects"""
-        print(f"    Attempting aggressive conflict resolution for {subject} in {cls}")
+        self.log("    Attempting aggressive conflict resolution for %s in %s", subject, cls)
         
-        # Create a backup of current state
-        backup_state = self.create_backup_state()
+        # Journal every move so it can be rolled back
+        mark = self.create_backup_state()
         
         # Get all currently scheduled subjects for this class
         scheduled_slots = list(self.schedule[cls].keys())
         random.shuffle(scheduled_slots)  # Randomize to avoid bias
         
-        moved_subjects = []
-        
         # Try to move up to 3 subjects to make room
         for attempt in range(min(3, len(scheduled_slots))):
             if attempt >= len(scheduled_slots):
@@ -503,17 +758,15 @@ class TimetableScheduler:
                 
             entry = self.schedule[cls][time_slot]
             other_subject = entry['subject']
-            other_teacher = entry['teacher']
             
-            print(f"    Trying to move {other_subject} from {time_slot}")
+            self.log("    Trying to move %s from %s", other_subject, time_slot)
             
             # Don't move lab sessions unless absolutely necessary
-            if other_subject.endswith(" Lab") and not subject.endswith(" Lab"):
+            if self._is_lab[other_subject] and not self._is_lab[subject]:
                 continue
             
             # Unschedule the existing subject
             self.unschedule_subject(cls, time_slot)
-            moved_subjects.append((other_subject, other_teacher, time_slot))
             
             # Try to schedule our target subject
             qualified_teachers = self.get_qualified_teachers(subject)
@@ -523,15 +776,17 @@ class TimetableScheduler:
                 slot_info = self.find_available_slot(cls, subject, teacher)
                 if slot_info:
                     target_time, target_room = slot_info
-                    if self.schedule_subject(cls, subject, teacher, target_room, target_time):
-                        target_scheduled = True
-                        print(f"    ✓ Successfully scheduled {subject} after moving {other_subject}")
-                        break
+                    self._schedule_subject_unchecked(cls, subject, teacher, target_room, target_time)
+                    target_scheduled = True
+                    self.log("    ✓ Successfully scheduled %s after moving %s", subject, other_subject)
+                    break
             
             if target_scheduled:
-                # Try to reschedule all moved subjects
+                # Try to reschedule all moved subjects, as recorded in the journal
+                moved_subjects = [record[3]['subject'] for record in self._undo_stack[mark:]
+                                  if record[0] == 'unschedule']
                 all_rescheduled = True
-                for moved_subject, moved_teacher, original_slot in moved_subjects:
+                for moved_subject in moved_subjects:
                     rescheduled = False
                     
                     # Try to find a new slot for the moved subject
@@ -539,78 +794,405 @@ class TimetableScheduler:
                         slot_info = self.find_available_slot(cls, moved_subject, attempt_teacher)
                         if slot_info:
                             new_time, new_room = slot_info
-                            if self.schedule_subject(cls, moved_subject, attempt_teacher, new_room, new_time):
-                                rescheduled = True
-                                print(f"    ✓ Rescheduled {moved_subject} to {new_time}")
-                                break
+                            self._schedule_subject_unchecked(cls, moved_subject, attempt_teacher, new_room, new_time)
+                            rescheduled = True
+                            self.log("    ✓ Rescheduled %s to %s", moved_subject, new_time)
+                            break
                     
                     if not rescheduled:
-                        print(f"    ✗ Could not reschedule {moved_subject}")
+                        self.log("    ✗ Could not reschedule %s", moved_subject)
                         all_rescheduled = False
                         break
                 
                 if all_rescheduled:
-                    print(f"    ✓ All conflicts resolved successfully")
+                    self.log("    ✓ All conflicts resolved successfully")
+                    self.discard_backup_state(mark)
                     return True
                 else:
-                    print(f"    ✗ Could not reschedule all moved subjects, reverting...")
-                    self.restore_backup_state(backup_state)
+                    self.log("    ✗ Could not reschedule all moved subjects, reverting...")
+                    self.restore_backup_state(mark)
                     return False
             else:
                 # Could not schedule target subject, try next
                 continue
         
         # If we get here, we couldn't resolve conflicts
-        print(f"    ✗ Could not resolve conflicts for {subject}")
-        self.restore_backup_state(backup_state)
+        self.log("    ✗ Could not resolve conflicts for %s", subject)
+        self.restore_backup_state(mark)
         return False
 
     def create_backup_state(self):
-        """Create a backup of current scheduling state"""
-        return {
-            'schedule': deepcopy(self.schedule),
-            'teacher_bookings': deepcopy(self.teacher_bookings),
-            'class_bookings': deepcopy(self.class_bookings),
-            'room_bookings': deepcopy(self.room_bookings),
-            'scheduled_counts': deepcopy(self.scheduled_counts),
-            'teacher_daily_load': deepcopy(self.teacher_daily_load),
-            'class_subject_time': deepcopy(self.class_subject_time),
-            'teacher_schedule': deepcopy(self.teacher_schedule),
-            'lab_room_bookings': deepcopy(self.lab_room_bookings),
-            'class_priority': deepcopy(self.class_priority)
-        }
+        """Start journaling changes and return a mark to roll back to"""
+        self._record = True
+        return len(self._undo_stack)
+    
+    def restore_backup_state(self, mark):
+        """Undo every journaled change made since the mark and close the backup"""
+        self._rewind_to(mark)
+        self.discard_backup_state(mark)
     
-    def restore_backup_state(self, backup_state):
-        """Restore scheduling state from backup"""
-        self.schedule = backup_state['schedule']
-        self.teacher_bookings = backup_state['teacher_bookings']
-        self.class_bookings = backup_state['class_bookings']
-        self.room_bookings = backup_state['room_bookings']
-        self.scheduled_counts = backup_state['scheduled_counts']
-        self.teacher_daily_load = backup_state['teacher_daily_load']
-        self.class_subject_time = backup_state['class_subject_time']
-        self.teacher_schedule = backup_state['teacher_schedule']
-        self.lab_room_bookings = backup_state['lab_room_bookings']
-        self.class_priority = backup_state['class_priority']
-
-    def generate_timetable(self):
-        """Enhanced scheduling algorithm with round-robin approach"""
-        print("Starting timetable generation...")
+    def _rewind_to(self, mark):
+        """Undo every journaled change made since the mark"""
+        recording = self._record
+        self._record = False
+        while len(self._undo_stack) > mark:
+            op, cls, time_slot, *rest = self._undo_stack.pop()
+            if op == 'schedule':
+                self.unschedule_subject(cls, time_slot)
+            else:
+                entry, level = rest
+                self._schedule_subject_unchecked(
+                    cls, entry['subject'], entry['teacher'], entry['room'], time_slot
+                )
+                self.assignment_level[(cls, time_slot)] = level
+        self._record = recording
+    
+    def discard_backup_state(self, mark):
+        """Keep the changes made since the mark; stop journaling once no backup is open"""
+        if mark == 0:
+            self._undo_stack.clear()
+            self._record = False
+
+    def has_available_slot(self, cls, subject):
+        """Check if a subject still has at least one valid (teacher, room, slot) for a class"""
+        # Reuse the last answer: a found assignment while it stays valid, or an
+        # empty domain while nothing has been freed that could refill it
+        key = (cls, subject)
+        cached = self._domain_cache.get(key)
+        if cached is not None:
+            version, witness = cached
+            if witness is not None:
+                # Witnesses come from the candidates, which already meet the
+                # static constraints (qualification, room type and capacity),
+                # so only bookings, daily load and lab order need rechecking
+                teacher, room_idx, slot_idx = witness
+                teacher_bookings = self.teacher_bookings[teacher]
+                if not ((teacher_bookings | self.class_bookings[cls] |
+                         self.room_bookings[room_idx]) >> slot_idx & 1 or
+                        (teacher_bookings & self.day_slot_mask[self.slot_day[slot_idx]]).bit_count()
+                        >= self.teacher_max_daily_load):
+                    if not self._is_lab[subject]:
+                        return True
+                    theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject], 0)
+                    if theory_bits & ((1 << slot_idx) - 1):
+                        return True
+            elif not self._domain_may_have_grown(version, cls, subject):
+                return False
         
-        # Create time slot index for quick comparison
-        self.time_slot_index = {slot: idx for idx, slot in enumerate(self.time_slots)}
+        witness = self._find_domain_witness(cls, subject)
+        self._domain_cache[key] = (self._state_version, witness)
+        return witness is not None
+
+    def _find_domain_witness(self, cls, subject):
+        """Find any valid (teacher, room_idx, slot_idx) for a subject from its candidates"""
+        teachers, room_ids = self._domain_candidates[(cls, subject)]
+        blocked = self.class_bookings[cls]
+        
+        # Labs need a theory session in an earlier slot
+        if self._is_lab[subject]:
+            theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject])
+            if not theory_bits:
+                return None
+            earliest_bit = theory_bits & -theory_bits
+            blocked |= (earliest_bit << 1) - 1
+        
+        for teacher in teachers:
+            teacher_bookings = self.teacher_bookings[teacher]
+            teacher_blocked = blocked | teacher_bookings
+            for day_mask in self.day_slot_mask:
+                if (teacher_bookings & day_mask).bit_count() >= self.teacher_max_daily_load:
+                    teacher_blocked |= day_mask
+            for room_idx in room_ids:
+                free = self.all_slots_mask & ~(teacher_blocked | self.room_bookings[room_idx])
+                if free:
+                    slot_idx = (free & -free).bit_length() - 1
+                    return teacher, room_idx, slot_idx
+        return None
+
+    def domain_size(self, cls, subject):
+        """Count the (teacher, room, time_slot) assignments left for a subject.
+        
+        Uses the same constraints as _find_domain_witness, so a lab whose
+        theory subject isn't scheduled yet has an empty domain.
+        """
+        teachers, room_ids = self._domain_candidates[(cls, subject)]
+        blocked = self.class_bookings[cls]
+        
+        if self._is_lab[subject]:
+            theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject])
+            if not theory_bits:
+                return 0
+            earliest_bit = theory_bits & -theory_bits
+            blocked |= (earliest_bit << 1) - 1
+        
+        room_free = [~self.room_bookings[room_idx] for room_idx in room_ids]
+        size = 0
+        for teacher in teachers:
+            teacher_bookings = self.teacher_bookings[teacher]
+            teacher_blocked = blocked | teacher_bookings
+            for day_mask in self.day_slot_mask:
+                if (teacher_bookings & day_mask).bit_count() >= self.teacher_max_daily_load:
+                    teacher_blocked |= day_mask
+            free = self.all_slots_mask & ~teacher_blocked
+            if free:
+                for room_mask in room_free:
+                    size += (free & room_mask).bit_count()
+        return size
+
+    def _domain_slots(self, cls, subject):
+        """Bitmask of the slots where a subject still has a valid (teacher, room)"""
+        teachers, room_ids = self._domain_candidates[(cls, subject)]
+        blocked = self.class_bookings[cls]
+        
+        if self._is_lab[subject]:
+            theory_bits = self._class_subject_slot_bits[cls].get(self._base_subject[subject])
+            if not theory_bits:
+                return 0
+            earliest_bit = theory_bits & -theory_bits
+            blocked |= (earliest_bit << 1) - 1
+        
+        room_free = 0
+        for room_idx in room_ids:
+            room_free |= ~self.room_bookings[room_idx]
+        slots = 0
+        for teacher in teachers:
+            teacher_bookings = self.teacher_bookings[teacher]
+            teacher_blocked = blocked | teacher_bookings
+            for day_mask in self.day_slot_mask:
+                if (teacher_bookings & day_mask).bit_count() >= self.teacher_max_daily_load:
+                    teacher_blocked |= day_mask
+            slots |= self.all_slots_mask & ~teacher_blocked
+        return slots & room_free
+
+    def _domain_may_have_grown(self, version, cls, subject):
+        """Check if anything that could add a valid assignment changed since version.
+        
+        Only removed bookings free slots, rooms and daily load; a lab can also
+        gain slots when its theory subject is scheduled.
+        """
+        if self._class_freed_version[cls] > version or self._room_freed_version > version:
+            return True
+        if self._is_lab[subject] and self._subject_version[(cls, self._base_subject[subject])] > version:
+            return True
+        return any(self._teacher_freed_version[teacher] > version
+                   for teacher in self._subject_to_teachers.get(subject, ()))
+
+    def unmet_subjects(self):
+        """List (class, subject) pairs that still need sessions"""
+        return [
+            (cls, subject)
+            for cls in self.classes
+            for subject, required in self.subject_assignments[cls].items()
+            if self.scheduled_counts[cls].get(subject, 0) < required
+        ]
+
+    def subjects_at_risk(self, cls, teacher):
+        """Subjects a session for a class with a teacher could wipe out, by day ID.
+        
+        Checks the subjects the placement constrains most: the class's own
+        and those the same teacher can teach. A placement only takes options
+        on its own day (the slot, and the teacher's daily load), so only an
+        unmet subject whose remaining options all fall on one day can lose
+        them all; subjects that are already empty don't count.
+        """
+        affected = [(cls, subject) for subject in self.subject_assignments[cls]]
+        affected += [key for key in self._subjects_by_teacher.get(teacher, ()) if key[0] != cls]
+        at_risk = defaultdict(list)
+        for key in affected:
+            other_cls, subject = key
+            if self.scheduled_counts[other_cls].get(subject, 0) >= self.subject_assignments[other_cls][subject]:
+                continue
+            slots = self._domain_slots(other_cls, subject)
+            if not slots:
+                continue
+            days = [day for day, day_mask in enumerate(self.day_slot_mask) if slots & day_mask]
+            if len(days) == 1:
+                at_risk[days[0]].append(key)
+        return at_risk
+
+    def place_session(self, cls, subject):
+        """Schedule one session of a subject, rejecting slots that fail forward checking"""
+        for teacher in self.get_qualified_teachers(subject):
+            if not self.forward_checking:
+                slot_info = self.find_available_slot(cls, subject, teacher)
+                if slot_info:
+                    # find_available_slot only returns valid assignments
+                    time_slot, room = slot_info
+                    self._schedule_subject_unchecked(cls, subject, teacher, room, time_slot)
+                    return True
+                continue
+            
+            ranked = self.ranked_slots(cls, subject, teacher)
+            if not ranked:
+                continue
+            
+            # Rank the teacher's options once; a rejected one is undone before
+            # the next, so the ranking and the subjects at risk stay valid
+            at_risk = self.subjects_at_risk(cls, teacher)
+            for time_slot, room in ranked:
+                self._schedule_subject_unchecked(cls, subject, teacher, room, time_slot)
+                
+                # Reject the slot if it emptied a domain that was non-empty before
+                if not any(
+                    self.scheduled_counts[other_cls].get(other, 0) < self.subject_assignments[other_cls][other]
+                    and not self.has_available_slot(other_cls, other)
+                    for other_cls, other in at_risk.get(self.time_slot_day[time_slot], ())
+                ):
+                    return True
+                
+                self.unschedule_subject(cls, time_slot)
+                self.log("  Forward check rejected %s for %s at %s in %s", subject, cls, time_slot, room)
+        return False
+
+    def find_conflicts(self, cls, subject):
+        """Find the assignments blocking any valid slot for a subject (its conflict set)"""
+        conflicts = set()
+        compatible = self.compatible_room_types(subject)
+        rooms = [room_idx for room_idx in range(len(self.room_names))
+                 if self.class_sizes[cls] <= self.room_capacity[room_idx] and
+                 compatible[self.room_type[room_idx]]]
+        room_users = {}
+        for other_cls in self.classes:
+            for time_slot, entry in self.schedule[other_cls].items():
+                room_users[(entry['room'], time_slot)] = other_cls
+        
+        for teacher in self.get_qualified_teachers(subject):
+            daily_loads = self.teacher_daily_loads(teacher)
+            for time_slot in self.time_slots:
+                # Class and teacher bookings, and a full teacher day
+                if time_slot in self.schedule[cls]:
+                    conflicts.add((cls, time_slot))
+                if time_slot in self.teacher_schedule[teacher]:
+                    conflicts.add((self.teacher_schedule[teacher][time_slot][0], time_slot))
+                day = self.time_slot_day[time_slot]
+                if daily_loads[day] >= self.teacher_max_daily_load:
+                    for other_slot, (other_cls, _) in self.teacher_schedule[teacher].items():
+                        if self.time_slot_day[other_slot] == day:
+                            conflicts.add((other_cls, other_slot))
+                # Room bookings, including the one lab allowed per slot
+                for room_idx in rooms:
+                    room = self.room_names[room_idx]
+                    if (room, time_slot) in room_users:
+                        conflicts.add((room_users[(room, time_slot)], time_slot))
+                    if self.room_type[room_idx] == LAB:
+                        for lab_room in self.lab_room_bookings.get(time_slot, ()):
+                            conflicts.add((room_users[(lab_room, time_slot)], time_slot))
+        return conflicts
+
+    def backjump(self, cls, subject):
+        """Conflict-directed backjumping (CBJ) from a dead-end subject.
+        
+        Undoes the deepest assignment in the subject's conflict set whose removal
+        lets it be placed, then re-places the undone session the same way, with
+        the rest of the conflict set merged into its own. Works from an explicit
+        stack and only jumps over assignments made before this call. Returns the
+        classes left with an undone session, or None (with nothing changed) if
+        the subject can't be placed.
+        """
+        if self.backjumps >= self.max_attempts:
+            return None
         
-        # Initialize class priority based on number of required sessions
+        mark = self.create_backup_state()
+        start_level = self.decision_counter
+        displaced = []
+        # (class, subject, conflict set inherited from the jump that undid it,
+        # whether it is the dead-end subject itself)
+        stack = [(cls, subject, set(), True)]
+        
+        while stack:
+            var_cls, var_subject, conflict_set, dead_end = stack.pop()
+            if not dead_end and self.place_session(var_cls, var_subject):
+                continue
+            conflict_set |= self.find_conflicts(var_cls, var_subject)
+            
+            # Jump back over the deepest culprit whose removal lets the subject in
+            culprits = sorted(
+                (key for key in conflict_set if self._can_undo(key, var_cls, var_subject, start_level)),
+                key=lambda key: -self.assignment_level[key]
+            )
+            placed = None
+            for culprit in culprits:
+                if self.backjumps >= self.max_attempts:
+                    break
+                var_mark = len(self._undo_stack)
+                culprit_cls, culprit_slot = culprit
+                culprit_subject = self.schedule[culprit_cls][culprit_slot]['subject']
+                self.unschedule_subject(culprit_cls, culprit_slot)
+                self.backjumps += 1
+                if self.place_session(var_cls, var_subject):
+                    self.log("  Backjumped over %s for %s at %s", culprit_subject, culprit_cls, culprit_slot)
+                    placed = (culprit_cls, culprit_subject)
+                    conflict_set.discard(culprit)
+                    break
+                self._rewind_to(var_mark)
+            
+            if placed is None:
+                if dead_end:
+                    # The dead-end subject itself can't be placed
+                    self.restore_backup_state(mark)
+                    return None
+                # Leave an undone session that can't be re-placed to later rounds
+                displaced.append(var_cls)
+                continue
+            stack.append((*placed, conflict_set, False))
+        
+        self.discard_backup_state(mark)
+        return displaced
+
+    def _can_undo(self, key, cls, subject, max_level):
+        """Check if an assignment in a conflict set may be undone to place a subject"""
+        level = self.assignment_level.get(key)
+        if level is None or level > max_level:
+            return False
+        culprit_cls, culprit_slot = key
+        culprit_subject = self.schedule[culprit_cls][culprit_slot]['subject']
+        # Moving the same subject around doesn't help, and a theory session
+        # can't be undone from under an already scheduled lab
+        if (culprit_cls, culprit_subject) == (cls, subject):
+            return False
+        return not self.class_subject_time[culprit_cls].get(f"{culprit_subject} Lab")
+
+    def generate_timetable(self, on_progress=None, cancel_event=None):
+        """Schedule every required session, most constrained subject first
+        (or round-robin over classes when use_mrv is off)
+        
+        on_progress, if given, is called with the partial response as sessions
+        are placed; generation stops early once cancel_event is set.
+        """
+        self.log("Starting timetable generation...")
+        
+        # Reset class priority (fraction of required sessions scheduled)
         for cls in self.classes:
-            total_required = sum(self.subject_assignments[cls].values())
-            self.class_priority[cls] = 0
+            self.class_priority[cls] = 0.0
+        
+        # Subjects in prerequisite order with their required sessions, per class
+        session_plan = {
+            cls: [(subject, self.subject_assignments[cls][subject])
+                  for subject in self.subject_order[cls]
+                  if subject in self.subject_assignments[cls]]
+            for cls in self.classes
+        }
+        
+        if self.use_mrv:
+            self._generate_most_constrained_first(session_plan, on_progress, cancel_event)
+        else:
+            self._generate_round_robin(session_plan, on_progress, cancel_event)
         
-        # Round-robin scheduling
+        self.log("\nTimetable generation completed!")
+        self.flush_log()
+
+    def _generate_round_robin(self, session_plan, on_progress, cancel_event):
+        """Place one session per class per round, least scheduled class first"""
         unscheduled_classes = set(self.classes)
         progress = True
         iteration = 0
+        self.backjumps = 0
         
         while unscheduled_classes and progress and iteration < 1000:
+            if cancel_event is not None and cancel_event.is_set():
+                self.log("Timetable generation cancelled")
+                break
+            
             iteration += 1
             progress = False
             
@@ -621,69 +1203,159 @@ class TimetableScheduler:
             )
             
             for cls in classes_by_priority:
-                # Get ordered subjects (prerequisites first)
-                ordered_subjects = self.subject_order[cls]
+                scheduled_counts = self.scheduled_counts[cls]
                 
-                # Find next unscheduled subject
-                for subject in ordered_subjects:
-                    if subject not in self.subject_assignments[cls]:
-                        continue
-                        
-                    required = self.subject_assignments[cls][subject]
-                    scheduled = self.scheduled_counts[cls].get(subject, 0)
-                    
-                    if scheduled < required:
+                # Find next unscheduled subject (prerequisites first)
+                for subject, required in session_plan[cls]:
+                    if scheduled_counts.get(subject, 0) < required:
                         # Try to schedule one session
-                        qualified_teachers = self.get_qualified_teachers(subject)
-                        if not qualified_teachers:
-                            continue
-                            
-                        for teacher in qualified_teachers:
-                            slot_info = self.find_available_slot(cls, subject, teacher)
-                            if slot_info:
-                                time_slot, room = slot_info
-                                if self.schedule_subject(cls, subject, teacher, room, time_slot):
-                                    print(f"Scheduled {subject} for {cls} with {teacher} at {time_slot}")
-                                    progress = True
-                                    break
+                        if self.place_session(cls, subject):
+                            self.log("Scheduled %s for %s", subject, cls)
+                            progress = True
+                        elif self.use_backjumping:
+                            # Dead end: jump back over conflicting assignments
+                            displaced = self.backjump(cls, subject)
+                            if displaced is not None:
+                                self.log("Scheduled %s for %s after backjumping", subject, cls)
+                                unscheduled_classes.update(displaced)
+                                progress = True
                         if progress:
                             break
                 else:
                     # All subjects scheduled for this class
                     unscheduled_classes.discard(cls)
-        
-        print("\nTimetable generation completed!")
+            
+            if progress and on_progress is not None:
+                on_progress(self.generate_timetable_response())
+
+    def _generate_most_constrained_first(self, session_plan, on_progress, cancel_event):
+        """Place one session at a time for the subject with the fewest options left.
+        
+        Unmet (class, subject) pairs sit in a lazy heap keyed by remaining domain
+        size (MRV), then by number of neighbors in the constraint graph (degree),
+        then by prerequisite order. A popped entry whose domain size changed since
+        it was pushed goes back in with its current size. Subjects that can't be
+        placed are set aside and retried after each pass that placed something.
+        """
+        order = {
+            (cls, subject): idx
+            for cls, plan in session_plan.items()
+            for idx, (subject, _) in enumerate(plan)
+        }
+        heap = []
+        
+        def push(key, size=None):
+            if size is None:
+                size = self.domain_size(*key)
+            heapq.heappush(heap, (size, -self._degree[key], order[key], key))
+        
+        def unmet(key):
+            cls, subject = key
+            return self.scheduled_counts[cls].get(subject, 0) < self.subject_assignments[cls][subject]
+        
+        for key in order:
+            push(key)
+        stuck = set()
+        placed = placed_before_pass = 0
+        steps = 0
+        self.backjumps = 0
+        
+        while steps < 1000 * len(self.classes):
+            if cancel_event is not None and cancel_event.is_set():
+                self.log("Timetable generation cancelled")
+                break
+            
+            if not heap:
+                # Retry the set-aside subjects while passes keep placing sessions
+                if not stuck or placed == placed_before_pass:
+                    break
+                placed_before_pass = placed
+                for key in stuck:
+                    if unmet(key):
+                        push(key)
+                stuck.clear()
+                continue
+            
+            size, _, _, key = heapq.heappop(heap)
+            if key in stuck or not unmet(key):
+                continue
+            current = self.domain_size(*key)
+            if current != size:
+                push(key, current)
+                continue
+            cls, subject = key
+            # A lab waits for its theory; placing the theory re-pushes it
+            if self._is_lab[subject] and not self._class_subject_slot_bits[cls].get(self._base_subject[subject]):
+                continue
+            
+            steps += 1
+            # Placing a session shrinks the other domains of its class most;
+            # any other stale sizes are caught when their entries are popped
+            refresh = [(cls, other) for other in self.subject_assignments[cls]]
+            if self.place_session(cls, subject):
+                self.log("Scheduled %s for %s", subject, cls)
+            elif self.use_backjumping and (displaced := self.backjump(cls, subject)) is not None:
+                self.log("Scheduled %s for %s after backjumping", subject, cls)
+                refresh += [(other_cls, other) for other_cls in displaced
+                            for other in self.subject_assignments[other_cls]]
+            else:
+                stuck.add(key)
+                continue
+            
+            placed += 1
+            for other in refresh:
+                if other not in stuck and unmet(other):
+                    push(other)
+            
+            if on_progress is not None and placed % len(self.classes) == 0:
+                on_progress(self.generate_timetable_response())
+
+    def log(self, message, *args):
+        """Buffer a progress message if verbose.
+        
+        Arguments are %-formatted into the message only when it is kept, so
+        quiet runs don't pay for formatting on the search paths.
+        """
+        if self.verbose:
+            self._log.append(message % args if args else message)
+
+    def flush_log(self):
+        """Print and clear the buffered progress messages"""
+        if self._log:
+            print("\n".join(self._log))
+            self._log.clear()
 
     def generate_timetable_response(self):
         """Convert the internal schedule to the API response format"""
+        # Reuse the constraint report while the schedule is unchanged
+        cached = self._response_cache
+        if cached is None or cached[0] != self._state_version:
+            cached = (self._state_version, self.verify_constraints())
+            self._response_cache = cached
+        constraints = cached[1]
+        total_required = self._total_required
+        total_scheduled = self._total_scheduled
+        
         response = {
             "schedule": defaultdict(dict),
             "statistics": {},
-            "constraints": self.verify_constraints()
+            "constraints": list(constraints)
         }
         
         # Convert schedule to the response format
         for cls in self.classes:
+            schedule = self.schedule[cls]
+            class_response = response["schedule"][cls]
             for time_slot in self.time_slots:
-                if time_slot in self.schedule[cls]:
-                    entry = self.schedule[cls][time_slot]
-                    response["schedule"][cls][time_slot] = {
+                entry = schedule.get(time_slot)
+                if entry is not None:
+                    class_response[time_slot] = {
                         "subject": entry['subject'],
                         "teacher": entry['teacher'],
                         "room": entry['room']
                     }
                 else:
-                    response["schedule"][cls][time_slot] = None
-        
-        # Calculate statistics
-        total_required = 0
-        total_scheduled = 0
-        
-        for cls in self.classes:
-            for subject, required in self.subject_assignments[cls].items():
-                scheduled = self.scheduled_counts[cls].get(subject, 0)
-                total_required += required
-                total_scheduled += scheduled
+                    class_response[time_slot] = None
         
         response["statistics"] = {
             "total_required": total_required,
@@ -692,7 +1364,7 @@ class TimetableScheduler:
             "teacher_utilization": [
                 {
                     "name": teacher,
-                    "total_sessions": sum(self.teacher_daily_load[teacher].values())
+                    "total_sessions": self.teacher_total_load(teacher)
                 }
                 for teacher in self.teachers
             ]
@@ -706,67 +1378,70 @@ class TimetableScheduler:
         
         # Check all subjects are scheduled required number of times
         for cls in self.classes:
+            counts = self.scheduled_counts[cls]
             for subject, required in self.subject_assignments[cls].items():
-                scheduled = self.scheduled_counts[cls].get(subject, 0)
+                scheduled = counts.get(subject, 0)
                 if scheduled != required:
                     errors.append(f"Class {cls} subject {subject}: scheduled {scheduled}, required {required}")
         
-        # Check teacher qualifications
-        for cls in self.classes:
-            for time_slot, entry in self.schedule[cls].items():
-                if entry:
-                    teacher = entry['teacher']
-                    subject = entry['subject']
-                    if subject not in self.teacher_qualifications.get(teacher, []):
-                        errors.append(f"Teacher {teacher} not qualified for {subject}")
-        
-        # Check room capacity
+        # Check qualifications, room capacity, teacher conflicts and lab
+        # prerequisites in one pass over the schedule, keeping each check's
+        # errors together in the report
+        qualification_errors = []
+        capacity_errors = []
+        conflict_errors = []
+        lab_errors = []
+        qualifications = self.teacher_qualifications
+        rooms = self.rooms
+        time_slot_index = self.time_slot_index
+        lab_theory = self.lab_theory
+        teacher_bits = defaultdict(int)
+        conflicting = set()
         for cls in self.classes:
+            class_size = self.class_sizes[cls]
+            slot_bits = self._class_subject_slot_bits[cls]
             for time_slot, entry in self.schedule[cls].items():
-                if entry:
-                    room = entry['room']
-                    if self.class_sizes[cls] > self.rooms[room]['capacity']:
-                        errors.append(f"Room {room} capacity exceeded for {cls}")
-        
-        # Check teacher conflicts
-        teacher_schedule = defaultdict(list)
-        for cls in self.classes:
-            for time_slot, entry in self.schedule[cls].items():
-                if entry:
-                    teacher = entry['teacher']
-                    teacher_schedule[teacher].append(time_slot)
-        
-        for teacher, slots in teacher_schedule.items():
-            if len(slots) != len(set(slots)):
-                errors.append(f"Teacher {teacher} has conflicting assignments")
-        
-        # Check lab prerequisites
-        for cls in self.classes:
-            for time_slot, entry in self.schedule[cls].items():
-                if entry and entry['subject'].endswith(" Lab"):
-                    lab_subject = entry['subject']
-                    theory_subject = lab_subject.replace(" Lab", "")
-                    
-                    if theory_subject in self.class_subject_time[cls]:
-                        theory_times = self.class_subject_time[cls][theory_subject]
-                        lab_time_idx = self.time_slot_index[time_slot]
-                        
-                        prereq_satisfied = any(
-                            self.time_slot_index[t] < lab_time_idx
-                            for t in theory_times
-                        )
-                        
-                        if not prereq_satisfied:
-                            errors.append(f"Lab {lab_subject} scheduled before theory in {cls}")
-        
-        return errors if errors else ["All constraints satisfied!"]
+                if not entry:
+                    continue
+                teacher = entry['teacher']
+                subject = entry['subject']
+                room = entry['room']
+                slot_idx = time_slot_index[time_slot]
+                
+                if subject not in qualifications.get(teacher, frozenset()):
+                    qualification_errors.append(f"Teacher {teacher} not qualified for {subject}")
+                
+                if class_size > rooms[room]['capacity']:
+                    capacity_errors.append(f"Room {room} capacity exceeded for {cls}")
+                
+                # Report each teacher at their first clash
+                if teacher not in conflicting:
+                    if teacher_bits[teacher] >> slot_idx & 1:
+                        conflicting.add(teacher)
+                        conflict_errors.append(f"Teacher {teacher} has conflicting assignments")
+                    else:
+                        teacher_bits[teacher] |= 1 << slot_idx
+                
+                theory_subject = lab_theory.get(subject)
+                if theory_subject:
+                    theory_bits = slot_bits.get(theory_subject)
+                    # Some theory session must sit below the lab's slot bit
+                    if theory_bits is not None and not theory_bits & ((1 << slot_idx) - 1):
+                        lab_errors.append(f"Lab {subject} scheduled before theory in {cls}")
+        
+        errors += qualification_errors
+        errors += capacity_errors
+        errors += conflict_errors
+        errors += lab_errors
+        
+        return errors if errors else [ALL_SATISFIED]
 
-def main(input_file):
-    """Main function to execute the timetable generation"""
-    # Load input data
-    with open(input_file, 'r') as f:
-        input_data = json.load(f)
+def generate(input_data, progress_queue=None, cancel_event=None):
+    """Generate a timetable from an input dictionary and return the response
     
+    Partial responses are put on progress_queue as generation proceeds, and
+    generation stops early once cancel_event is set.
+    """
     # Create scheduler instance
     scheduler = TimetableScheduler(
         teachers=input_data['teachers'],
@@ -781,23 +1456,63 @@ def main(input_file):
         class_sizes=input_data['class_sizes'],
         teacher_max_daily_load=input_data.get('teacher_max_daily_load', 5),
         consecutive_preferred=input_data.get('consecutive_preferred', True),
-        max_attempts=input_data.get('max_attempts', 200)
+        max_attempts=input_data.get('max_attempts', 200),
+        forward_checking=input_data.get('forward_checking', True),
+        use_backjumping=input_data.get('use_backjumping', True),
+        use_mrv=input_data.get('use_mrv', True),
+        verbose=input_data.get('verbose', False)
     )
     
     # Generate timetable
-    scheduler.generate_timetable()
+    on_progress = progress_queue.put if progress_queue is not None else None
+    scheduler.generate_timetable(on_progress, cancel_event)
     
     # Prepare response
-    response = scheduler.generate_timetable_response()
+    return scheduler.generate_timetable_response()
+
+def dump_response(response, indent=False):
+    """Serialize a response to UTF-8 JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(response, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(response, indent=2 if indent else None).encode()
+
+def main(input_file=None):
+    """Main function to execute the timetable generation"""
+    if input_file is None:
+        # Pipe mode: read input from stdin and write the response to stdout,
+        # keeping progress output on stderr so it doesn't corrupt the JSON
+        input_data = json.loads(sys.stdin.buffer.read())
+        input_data.setdefault('verbose', True)
+        with redirect_stdout(sys.stderr):
+            response = generate(input_data)
+        sys.stdout.flush()
+        sys.stdout.buffer.write(dump_response(response))
+        return
+    
+    # Load input data
+    with open(input_file, 'r') as f:
+        input_data = json.load(f)
+    input_data.setdefault('verbose', True)
+    
+    response = generate(input_data)
     
-    # Save output
+    # Save output via a temp file so a failed write never leaves a partial file
     output_file = input_file.replace('input', 'output')
-    with open(output_file, 'w') as f:
-        json.dump(response, f, indent=2)
+    fd, tmp_path = tempfile.mkstemp(prefix="tt_out_", suffix=".json",
+                                    dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dump_response(response, indent=True))
+        os.replace(tmp_path, output_file)
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python timetable_generator.py <input_file>")
+    if len(sys.argv) > 2:
+        print("Usage: python timetable_generator.py [input_file]")
         sys.exit(1)
     
-    main(sys.argv[1])
\ No newline at end of file
+    main(sys.argv[1] if len(sys.argv) == 2 else None)